@@ -0,0 +1,36 @@
+"""Optional numba-compiled kernels with NumPy fallbacks.
+
+numba is deliberately not in requirements.txt: installing it is an opt-in
+that turns haversine_nm into a parallel compiled loop; without it the
+NumPy version below is used and nothing else changes.
+"""
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+if njit is not None:
+    @njit(cache=True, fastmath=True, parallel=True)
+    def haversine_nm(lat1, lon1, lats, lons):
+        """Haversine distance in NM from one point to arrays of points."""
+        rl1 = np.radians(lat1)
+        rlo1 = np.radians(lon1)
+        c1 = np.cos(rl1)
+        out = np.empty(lats.shape[0])
+        for i in prange(lats.shape[0]):
+            la = np.radians(lats[i])
+            lo = np.radians(lons[i])
+            a = np.sin((la - rl1)/2.0)**2 + c1*np.cos(la)*np.sin((lo - rlo1)/2.0)**2
+            out[i] = 6371.0 * 2.0 * np.arcsin(np.sqrt(a)) * 0.539957
+        return out
+else:
+    def haversine_nm(lat1, lon1, lats, lons):
+        """Haversine distance in NM from one point to arrays of points."""
+        rl1 = np.radians(lat1)
+        rlo1 = np.radians(lon1)
+        la = np.radians(np.asarray(lats, dtype=np.float64))
+        lo = np.radians(np.asarray(lons, dtype=np.float64))
+        a = np.sin((la - rl1)/2.0)**2 + np.cos(rl1)*np.cos(la)*np.sin((lo - rlo1)/2.0)**2
+        return 6371.0 * 2.0 * np.arcsin(np.sqrt(a)) * 0.539957
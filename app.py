@@ -1,19 +1,14 @@
 # app.py
-import os, io, json, csv, itertools
+import os, json, copy, hashlib, itertools
 from typing import Dict, List, Optional
+import numpy as np
 import pandas as pd
 import streamlit as st
-import folium
-from folium.plugins import HeatMap
-from streamlit_folium import st_folium
-
-from routing import compute_route, list_to_latlon, eta_hours
-from weather_providers import get_weather, render_weather_card_safe
-from data_sources import (
-    load_wpi, clean_piracy_df, load_congestion_advanced, load_alias_map,
-    get_row_by_main, latlon_from_row, _norm_country,
-)
-from risk import piracy_hits_along_route
+
+from routing import compute_route, list_to_latlon, eta_hours, best_stop_order
+from weather_providers import get_weather, get_weather_many, render_weather_card_safe
+from data_sources import load_wpi, load_piracy, load_congestion_advanced, load_alias_map
+from risk import piracy_hits_along_route, piracy_tree, build_piracy_index
 from portswitch import evaluate_portswitch, draw_portswitch_markers
 
 # ---------------- App config ----------------
@@ -32,13 +27,15 @@ with left:
 with right:
     piracy_file = st.file_uploader("Upload Piracy Incidents CSV (any LAT/LON columns)", type=["csv"])
 
-rows, mains, country_col, ports_by_country = load_wpi(wpi_file.getvalue() if wpi_file else None)
+rows, mains, country_col, ports_by_country, by_main, latlon_by_main, country_names_sorted = load_wpi(wpi_file.getvalue() if wpi_file else None)
 
 piracy_df = None
+piracy_sig = None  # stable content key — id() changes across cache_data copies
 if piracy_file:
     try:
-        raw = pd.read_csv(piracy_file)
-        piracy_df = clean_piracy_df(raw)
+        piracy_bytes = piracy_file.getvalue()
+        piracy_sig = hashlib.md5(piracy_bytes).hexdigest()
+        piracy_df = load_piracy(piracy_bytes)
         if piracy_df.empty:
             st.warning("Piracy CSV loaded but no valid LAT/LON found.")
         else:
@@ -73,7 +70,7 @@ with st.form("controls"):
         if use_country and ports_by_country:
             country_val = st.selectbox(
                 f"{label_prefix} country",
-                options=sorted(ports_by_country.keys()),
+                options=country_names_sorted,
                 key=f"{label_prefix}_country",
                 disabled=no_wpi
             )
@@ -192,16 +189,16 @@ if submitted:
 
     # resolve endpoints
     if mode == "Pick ports from list":
-        o_row=get_row_by_main(origin, rows); d_row=get_row_by_main(dest, rows)
-        if not o_row or not d_row:
+        o_ll=latlon_by_main.get(origin); d_ll=latlon_by_main.get(dest)
+        if not o_ll or not d_ll:
             st.error("Could not resolve selected ports."); st.stop()
-        o_lat,o_lon = latlon_from_row(o_row); d_lat,d_lon = latlon_from_row(d_row)
+        o_lat,o_lon = o_ll; d_lat,d_lon = d_ll
         o_name, d_name = origin, dest
         alt_target=None
         if alt_dest and alt_dest!="— none —":
-            a_row=get_row_by_main(alt_dest, rows)
-            if a_row:
-                a_lat,a_lon = latlon_from_row(a_row)
+            a_ll=latlon_by_main.get(alt_dest)
+            if a_ll:
+                a_lat,a_lon = a_ll
                 alt_target=("Alt", a_lon, a_lat)
     else:
         o_name, d_name = "Origin (custom)", "Destination (custom)"
@@ -211,36 +208,38 @@ if submitted:
 
     # path building (with optional stop optimization)
     chosen_path=[(o_lat,o_lon,o_name)]
-    if (mode=="Pick ports from list") and stops and st.session_state.get("allow_opt", True) and st.session_state.get("allow_opt", True):
-        if optimize:
-            best_nm=float("inf"); best_seq=None
-            for perm in itertools.permutations(stops):
-                seq=[o_name,*perm,d_name]
-                nm_sum=0.0; ok=True; resolved=[]
-                for nm in seq:
-                    if nm==o_name: resolved.append((o_lat,o_lon,o_name)); continue
-                    if nm==d_name: resolved.append((d_lat,d_lon,d_name)); continue
-                    rw=get_row_by_main(nm, rows)
-                    if not rw: ok=False; break
-                    lat,lon=latlon_from_row(rw); resolved.append((lat,lon,nm))
-                if not ok: continue
-                for i in range(len(resolved)-1):
-                    _,_, nm_leg = compute_route(resolved[i][0],resolved[i][1],resolved[i+1][0],resolved[i+1][1])
-                    nm_sum+=nm_leg
-                if nm_sum<best_nm: best_nm, best_seq = nm_sum, resolved
-            if best_seq:
-                chosen_path=best_seq; d_lat,d_lon,d_name = best_seq[-1]
+    if (mode=="Pick ports from list") and stops and st.session_state.get("allow_opt", True):
+        # resolve each waypoint once; stops without coordinates are dropped
+        points=[(o_lat,o_lon,o_name)]
+        for nm in stops:
+            ll=latlon_by_main.get(nm)
+            if ll: points.append((ll[0],ll[1],nm))
+        points.append((d_lat,d_lon,d_name))
+        if optimize and len(points)>3:
+            # compute each unique leg once (O(k²) routes instead of O(k!·k))
+            n=len(points)
+            leg_nm={}
+            for i,j in itertools.combinations(range(n), 2):
+                _,_, nm_leg = compute_route(points[i][0],points[i][1],points[j][0],points[j][1])
+                leg_nm[(i,j)]=leg_nm[(j,i)]=nm_leg
+            D=[[leg_nm.get((i,j), 0.0) for j in range(n)] for i in range(n)]
+            best_order=best_stop_order(D)
+            chosen_path=[points[i] for i in best_order]
+        else:
+            chosen_path=points
+        d_lat,d_lon,d_name = chosen_path[-1]
     else:
         chosen_path.append((d_lat,d_lon,d_name))
 
     # build final route (lon,lat)
-    route_coords=[]; dist_km_total=0.0; dist_nm_total=0.0; leg_summ=[]
+    leg_arrays=[]; dist_km_total=0.0; dist_nm_total=0.0; leg_summ=[]
     for i in range(len(chosen_path)-1):
         a=chosen_path[i]; b=chosen_path[i+1]
         coords, km, nm = compute_route(a[0],a[1],b[0],b[1])
-        route_coords.extend(coords if i==0 else coords[1:])  # keep lon,lat
+        leg_arrays.append(np.asarray(coords, dtype=np.float64)[(1 if i else 0):])  # keep lon,lat
         dist_km_total+=km; dist_nm_total+=nm
         leg_summ.append((a[2],b[2],km,nm))
+    route_coords = np.concatenate(leg_arrays, axis=0) if leg_arrays else np.empty((0,2))
 
     eta_total = eta_hours(dist_nm_total, speed_kn)  # hours
 
@@ -252,7 +251,9 @@ if submitted:
     co2_intensity_kg_per_nm = (co2_tonnes*1000.0)/max(dist_nm_total, 1e-6)
 
     # Piracy risk
-    risk_hits, total_inc = piracy_hits_along_route(route_coords, piracy_df, buffer_km)
+    risk_hits, total_inc = piracy_hits_along_route(route_coords, piracy_df, buffer_km,
+                                                   tree=piracy_tree(piracy_df),
+                                                   index=build_piracy_index(piracy_df))
 
     st.session_state.route_info = dict(
         origin=chosen_path[0][2], destination=d_name,
@@ -288,7 +289,59 @@ if submitted:
 route_info = st.session_state.route_info
 alt_info   = st.session_state.alt_info
 
+def _coords_sig(coords_lonlat) -> str:
+    return hashlib.md5(np.asarray(coords_lonlat, dtype=np.float64).tobytes()).hexdigest()
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def build_fmap(route_sig: str, alt_sig: Optional[str], piracy_key: Optional[str],
+               _route_info: dict, _alt_info: Optional[dict], _piracy_df) -> "folium.Map":
+    # keyed on the signatures only (underscore args are not hashed), so widget
+    # reruns that don't change route/alt/piracy skip the whole re-serialization
+    oc = _route_info["coords_lonlat"]  # lon,lat
+    center_lat = (oc[0][1]+oc[-1][1])/2
+    center_lon = (oc[0][0]+oc[-1][0])/2
+    fmap = folium.Map(location=[center_lat, center_lon], zoom_start=4, tiles="CartoDB positron")
+
+    folium.PolyLine(
+        list_to_latlon(oc),
+        weight=4, opacity=0.95, color="blue",
+        tooltip=f"{_route_info['origin']} → {_route_info['destination']}"
+    ).add_to(fmap)
+    folium.Marker([oc[0][1], oc[0][0]], tooltip=_route_info["origin"]).add_to(fmap)
+    folium.Marker([oc[-1][1], oc[-1][0]], tooltip=_route_info["destination"]).add_to(fmap)
+
+    if _piracy_df is not None and not _piracy_df.empty:
+        try:
+            # build the [lat,lon,weight] list once per uploaded CSV, not per rerun
+            if st.session_state.get("piracy_heat_key") != piracy_key:
+                src = _piracy_df if len(_piracy_df) <= 20000 else _piracy_df.sample(n=20000, random_state=0)
+                st.session_state["piracy_heat_list"] = np.column_stack([
+                    src["LAT"].to_numpy(np.float32),
+                    src["LON"].to_numpy(np.float32),
+                    np.ones(len(src), np.float32),
+                ]).tolist()
+                st.session_state["piracy_heat_key"] = piracy_key
+            HeatMap(st.session_state["piracy_heat_list"], radius=8, blur=5).add_to(fmap)
+        except Exception:
+            pass
+
+    if _alt_info:
+        ac = _alt_info["coords_lonlat"]
+        folium.PolyLine(
+            list_to_latlon(ac),
+            weight=4, opacity=0.85, color="red",
+            tooltip=f"{_alt_info['origin']} → {_alt_info['destination']} (alt)"
+        ).add_to(fmap)
+        folium.Marker([ac[-1][1], ac[-1][0]], tooltip=f"Alt: {_alt_info['destination']}").add_to(fmap)
+    return fmap
+
 if route_info:
+    # deferred until a route exists: folium pulls in branca/jinja2, which is
+    # a noticeable chunk of cold-start for sessions that never hit Compute
+    import folium
+    from folium.plugins import HeatMap
+    from streamlit_folium import st_folium
+
     st.markdown("### 3) Results")
     c1,c2,c3,c4 = st.columns(4)
     c1.metric("Origin", route_info["origin"])
@@ -316,40 +369,23 @@ if route_info:
         )
 
     oc = route_info["coords_lonlat"]  # lon,lat
-    center_lat = (oc[0][1]+oc[-1][1])/2
-    center_lon = (oc[0][0]+oc[-1][0])/2
-    fmap = folium.Map(location=[center_lat, center_lon], zoom_start=4, tiles="CartoDB positron")
-
-    folium.PolyLine(
-        list_to_latlon(oc),
-        weight=4, opacity=0.95, color="blue",
-        tooltip=f"{route_info['origin']} → {route_info['destination']}"
-    ).add_to(fmap)
-    folium.Marker([oc[0][1], oc[0][0]], tooltip=route_info["origin"]).add_to(fmap)
-    folium.Marker([oc[-1][1], oc[-1][0]], tooltip=route_info["destination"]).add_to(fmap)
-
-    if piracy_df is not None and not piracy_df.empty:
-        try:
-            pts = piracy_df[["LAT","LON"]].astype(float).values.tolist()
-            HeatMap([[lat,lon,1] for lat,lon in pts], radius=8, blur=5).add_to(fmap)
-        except Exception:
-            pass
+    fmap = build_fmap(
+        _coords_sig(oc),
+        _coords_sig(alt_info["coords_lonlat"]) if alt_info else None,
+        piracy_sig,
+        route_info, alt_info, piracy_df,
+    )
 
     if alt_info:
-        ac = alt_info["coords_lonlat"]
-        folium.PolyLine(
-            list_to_latlon(ac),
-            weight=4, opacity=0.85, color="red",
-            tooltip=f"{alt_info['origin']} → {alt_info['destination']} (alt)"
-        ).add_to(fmap)
-        folium.Marker([ac[-1][1], ac[-1][0]], tooltip=f"Alt: {alt_info['destination']}").add_to(fmap)
         a1,a2,a3 = st.columns(3)
         a1.metric("ALT distance", f"{alt_info['distance_km']:,.1f} km ({alt_info['distance_nm']:,.1f} NM)")
         a2.metric("ALT CO₂", f"{alt_info['co2_tonnes']:.2f} tCO₂")
         a3.metric("ALT fuel cost", f"${alt_info['cost_usd']:,.0f}")
         st.caption("Blue = main route, Red = alternate destination")
 
-    st_folium(fmap, width=None, height=600)
+    # the map is rendered exactly once, after PortSwitch has (maybe) added its
+    # markers — this placeholder keeps it at its usual spot on the page
+    map_slot = st.container()
 
     # legs table
     if route_info["legs"]:
@@ -377,10 +413,10 @@ if route_info:
         if 'sample_along' in locals() and sample_along:
             st.markdown("#### Weather along route (samples)")
             idxs = [round(i*(len(oc)-1)/(samples-1)) for i in range(samples)]
+            pts = [(float(oc[idx][1]), float(oc[idx][0])) for idx in idxs]
+            wx_all = get_weather_many(weather_provider, pts, owm_key, units="metric")
             rows_wx = []
-            for j, idx in enumerate(idxs, start=1):
-                lon, lat = oc[idx]
-                wx = get_weather(weather_provider, lat, lon, owm_key, units="metric")
+            for j, ((lat, lon), wx) in enumerate(zip(pts, wx_all), start=1):
                 if wx and not wx.get("_error") and wx.get("current"):
                     cur = wx["current"]
                     rows_wx.append({
@@ -398,18 +434,23 @@ if route_info:
     # ---------- Downloads ----------
     colD1,colD2 = st.columns(2)
     gj = {"type":"Feature",
-          "geometry":{"type":"LineString","coordinates":route_info["coords_lonlat"]},
+          "geometry":{"type":"LineString","coordinates":np.asarray(route_info["coords_lonlat"]).tolist()},
           "properties":{"origin":route_info["origin"],"destination":route_info["destination"],
                         "distance_km":route_info["distance_km"],"distance_nm":route_info["distance_nm"],
                         "eta_hours_at_speed": route_info["eta_hours"],
                         "fuel_tonnes": route_info["fuel_tonnes"],
                         "co2_tonnes": route_info["co2_tonnes"],
                         "fuel_cost_usd": route_info["cost_usd"]}}
-    colD1.download_button("Download Route GeoJSON", data=json.dumps(gj, indent=2),
+    try:
+        import orjson
+        gj_bytes = orjson.dumps(gj)
+    except ImportError:
+        gj_bytes = json.dumps(gj, separators=(",", ":")).encode()
+    colD1.download_button("Download Route GeoJSON", data=gj_bytes,
                           file_name="route.geojson", mime="application/geo+json")
-    buf=io.StringIO(); cw=csv.writer(buf); cw.writerow(["lon","lat"])
-    for lon,lat in route_info["coords_lonlat"]: cw.writerow([lon,lat])
-    colD2.download_button("Download Route CSV", data=buf.getvalue(),
+    csv_bytes = pd.DataFrame(route_info["coords_lonlat"], columns=["lon","lat"]) \
+                  .to_csv(index=False).encode()
+    colD2.download_button("Download Route CSV", data=csv_bytes,
                           file_name="route_points.csv", mime="text/csv")
 
     # ---------- Smart PortSwitch ----------
@@ -427,12 +468,14 @@ if route_info:
     }
 
     ps_result = evaluate_portswitch(
-        route_info, rows, mains, ports_by_country, country_col,
+        route_info, by_main, latlon_by_main, mains, ports_by_country, country_col,
         speed_kn, cons_tpd, ef_tco2_per_t_fuel, fuel_price,
         CONG, ALIAS, fuzzy_threshold, geo_radius_km, ps_controls
     )
 
     if ps_result is None:
+        # nothing to draw — the pristine cached map renders below, so no
+        # stale candidate markers can linger
         st.info("No alternate ports found that match the filters.")
     else:
         df, best_row = ps_result
@@ -443,8 +486,12 @@ if route_info:
         )
         st.success(f"Recommendation: **{best_row['Port']}** (score {best_row['score']:.3f})")
 
-        draw_portswitch_markers(df, ps_controls["top_n_show"], best_row, fmap)
-        st_folium(fmap, width=None, height=600)
+        # the cache_resource map is shared across sessions, so it must never
+        # be mutated: attach the markers to a per-rerun deep copy instead
+        ps_fg = folium.FeatureGroup(name="PortSwitch candidates")
+        draw_portswitch_markers(df, ps_controls["top_n_show"], best_row, ps_fg)
+        fmap = copy.deepcopy(fmap)
+        ps_fg.add_to(fmap)
 
         if st.button("Choose Best Route"):
             st.session_state.route_info.update({
@@ -458,5 +505,8 @@ if route_info:
                 "coords_lonlat": list(best_row["coords"]),
             })
             st.toast("✅ Best route selected. Map & calculations updated.")
+
+    with map_slot:
+        st_folium(fmap, width=None, height=600)
 else:
     st.info("Upload your WPI CSV (or place it next to app.py), set controls, then press **Compute / Update**.")
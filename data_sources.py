@@ -1,175 +1,238 @@
-import os, io, csv, re, unicodedata
-from typing import Dict, List, Tuple, Optional
-import pandas as pd
-import streamlit as st
-
-# ---- Robust parsing for piracy csv ----
-PIRACY_LAT_ALIASES = {"LAT","Latitude","latitude","Lat","LATITUDE","Y","y","lat_dd"}
-PIRACY_LON_ALIASES = {"LON","Longitude","longitude","Lon","LONGITUDE","X","x","lon_dd","LONG","long","LNG","lng"}
-
-def _parse_dms(token: str) -> Optional[float]:
-    s = token.strip().upper().replace("º","°").replace("’","'").replace("”",'"')
-    m = re.match(r"^\s*(\d+)[\-\s°]?(\d+)?(?:[\-\s']?(\d+(?:\.\d+)?))?\s*([NSEW])\s*$", s) or \
-        re.match(r"^\s*(\d+)\s*°\s*(\d+)?\s*(?:'\s*(\d+(?:\.\d+)?)\s*\"?)?\s*([NSEW])\s*$", s)
-    if not m: return None
-    deg, mins, secs, hemi = float(m.group(1)), float(m.group(2) or 0), float(m.group(3) or 0), m.group(4)
-    dec = deg + mins/60 + secs/3600
-    return -dec if hemi in ("S","W") else dec
-
-def _to_float_coord_general(val):
-    if pd.isna(val): return None
-    if isinstance(val, (int,float)): return float(val)
-    s=str(val).strip()
-    m = re.match(r"^\s*([0-9.+\-: °'\"/]+)\s*([NSEW])\s*$", s, re.I)
-    if m:
-        num, hemi = m.group(1), m.group(2).upper()
-        d = _parse_dms(num) if any(ch in num for ch in "°'") else None
-        if d is None:
-            try: d=float(num)
-            except: return None
-        return -abs(d) if hemi in ("S","W") else abs(d)
-    if any(ch in s for ch in "°'"):
-        return _parse_dms(s)
-    try: return float(s)
-    except: return None
-
-def _fix_lon_360(lon):
-    if lon is None: return None
-    if lon > 180.0: return lon - 360.0
-    if lon < -180.0: return None
-    return lon
-
-def clean_piracy_df(df: pd.DataFrame) -> pd.DataFrame:
-    if df is None or df.empty: return pd.DataFrame(columns=["LAT","LON"])
-    cols = {c.strip(): c for c in df.columns}
-    lat_col = next((cols[c] for c in cols if c in PIRACY_LAT_ALIASES), None)
-    lon_col = next((cols[c] for c in cols if c in PIRACY_LON_ALIASES), None)
-    if lat_col is None or lon_col is None:
-        cand = [c for c in df.columns if c.lower().startswith(("lat","y"))]
-        lat_col = lat_col or (cand[0] if cand else None)
-        cand = [c for c in df.columns if c.lower().startswith(("lon","x","long","lng"))]
-        lon_col = lon_col or (cand[0] if cand else None)
-    if lat_col is None or lon_col is None:
-        return pd.DataFrame(columns=["LAT","LON"])
-    lat = df[lat_col].apply(_to_float_coord_general)
-    lon = df[lon_col].apply(_to_float_coord_general).apply(_fix_lon_360)
-    out = pd.DataFrame({"LAT": lat, "LON": lon}).dropna()
-    out = out[(out["LAT"].between(-90, 90)) & (out["LON"].between(-180, 180))]
-    return out.drop_duplicates()
-
-def _norm_country(c):
-    if c is None or (isinstance(c, float) and pd.isna(c)):
-        return "Unknown"
-    c = re.split(r"[(/,]| - ", str(c))[0].strip()
-    return c.title()
-
-@st.cache_data(show_spinner=False)
-def load_wpi(df_bytes: Optional[bytes]) -> Tuple[List[Dict[str,str]], List[str], Optional[str], Dict[str, List[str]]]:
-    """
-    Return: (rows, all_port_names, country_col_name_or_None, ports_by_country)
-    """
-    if df_bytes is None:
-        path="UpdatedPub150.csv"
-        if not os.path.exists(path): return [], [], None, {}
-        with open(path,"rb") as f: df_bytes=f.read()
-    text=df_bytes.decode("utf-8-sig","ignore")
-    reader=csv.DictReader(io.StringIO(text))
-    rows=list(reader)
-    if not rows: return [], [], None, {}
-
-    for req in ["Main Port Name","Latitude","Longitude"]:
-        if req not in rows[0]:
-            st.error(f"CSV missing '{req}'. Found: {list(rows[0].keys())}")
-            return [], [], None, {}
-
-    country_col = None
-    for c in rows[0].keys():
-        if "country" in c.lower():
-            country_col = c; break
-
-    mains=sorted({r["Main Port Name"] for r in rows if r.get("Main Port Name")})
-
-    ports_by_country: Dict[str,List[str]] = {}
-    if country_col:
-        for r in rows:
-            name=r.get("Main Port Name")
-            if not name: continue
-            c = _norm_country(r.get(country_col))
-            ports_by_country.setdefault(c, []).append(name)
-        for k in list(ports_by_country.keys()):
-            ports_by_country[k]=sorted(set(ports_by_country[k]))
-
-    return rows, mains, country_col, ports_by_country
-
-def get_row_by_main(name: str, rows: List[Dict[str,str]]) -> Optional[Dict[str,str]]:
-    for r in rows:
-        if r.get("Main Port Name")==name: return r
-    return None
-
-def latlon_from_row(r: Dict[str,str]):
-    def _to_float_coord(val: str) -> float:
-        s = re.sub(r"(\d),(\d)", r"\\1.\\2", (val or "").strip())
-        try: return float(s)
-        except:
-            d=_parse_dms(s)
-            if d is None: raise ValueError(f"Unsupported coordinate: '{val}'")
-            return d
-    return _to_float_coord(r["Latitude"]), _to_float_coord(r["Longitude"])
-
-# ---------- Congestion & alias ----------
-@st.cache_data(show_spinner=False)
-def load_congestion_advanced(df_bytes):
-    from utils import canon_name
-    if df_bytes is None:
-        return {"by_name":{}, "geo":None, "raw":pd.DataFrame()}
-    text = df_bytes.decode("utf-8-sig","ignore")
-    reader = csv.DictReader(io.StringIO(text))
-    rows = list(reader)
-    if not rows:
-        return {"by_name":{}, "geo":None, "raw":pd.DataFrame()}
-    df = pd.DataFrame(rows)
-    name_col = next((c for c in df.columns if c.lower() in ("port","name","port_name","portname")), None)
-    wait_col = next((c for c in df.columns if c.lower() in ("waittime_hr","wait_hr","waithours","wait_hours","wait","delay_hr","delay_hours")), None)
-    lat_col  = next((c for c in df.columns if c.lower() in ("lat","latitude","y")), None)
-    lon_col  = next((c for c in df.columns if c.lower() in ("lon","longitude","x","long","lng")), None)
-
-    if name_col is None or wait_col is None:
-        st.warning("Congestion CSV needs at least a Port/Name column and a WaitTime_hr (or equivalent) column.")
-        return {"by_name":{}, "geo":None, "raw":df}
-
-    df["__port_name__"] = df[name_col].astype(str)
-    df["__wait__"] = pd.to_numeric(df[wait_col], errors="coerce").fillna(0.0)
-    df["__key__"] = df["__port_name__"].map(canon_name)
-
-    by_name = {}
-    for _, r in df.iterrows():
-        k = r["__key__"]
-        if not k: 
-            continue
-        by_name[k] = float(r["__wait__"])
-
-    geo_df = None
-    if lat_col and lon_col:
-        def _num(x):
-            try: return float(x)
-            except: return None
-        df["__lat__"] = df[lat_col].map(_num)
-        df["__lon__"] = df[lon_col].map(_num)
-        geo_df = df.dropna(subset=["__lat__","__lon__"])[["__port_name__","__wait__","__lat__","__lon__"]].copy()
-
-    return {"by_name": by_name, "geo": geo_df, "raw": df}
-
-@st.cache_data(show_spinner=False)
-def load_alias_map(df_bytes):
-    from utils import canon_name
-    if df_bytes is None: 
-        return {}
-    text = df_bytes.decode("utf-8-sig","ignore")
-    reader = csv.DictReader(io.StringIO(text))
-    alias = {}
-    for row in reader:
-        wpi = canon_name(row.get("WPI_Name",""))
-        src = canon_name(row.get("Source_Name",""))
-        if wpi and src:
-            alias[wpi] = src
-    return alias
+import os, io, csv, re, unicodedata
+from functools import lru_cache
+from typing import Dict, List, Tuple, Optional
+import pandas as pd
+import streamlit as st
+
+# ---- Robust parsing for piracy csv ----
+PIRACY_LAT_ALIASES = {"LAT","Latitude","latitude","Lat","LATITUDE","Y","y","lat_dd"}
+PIRACY_LON_ALIASES = {"LON","Longitude","longitude","Lon","LONGITUDE","X","x","lon_dd","LONG","long","LNG","lng"}
+
+# compiled once: these run per value on the parsing fallback paths
+_DMS_RE_A = re.compile(r"^\s*(\d+)[\-\s°]?(\d+)?(?:[\-\s']?(\d+(?:\.\d+)?))?\s*([NSEW])\s*$")
+_DMS_RE_B = re.compile(r"^\s*(\d+)\s*°\s*(\d+)?\s*(?:'\s*(\d+(?:\.\d+)?)\s*\"?)?\s*([NSEW])\s*$")
+_HEMI_WRAP_RE = re.compile(r"^\s*([0-9.+\-: °'\"/]+)\s*([NSEW])\s*$", re.I)
+_DEC_COMMA_RE = re.compile(r"(\d),(\d)")
+_COUNTRY_SPLIT_RE = re.compile(r"[(/,]| - ")
+
+def _parse_dms(token: str) -> Optional[float]:
+    s = token.strip().upper().replace("º","°").replace("’","'").replace("”",'"')
+    m = _DMS_RE_A.match(s) or _DMS_RE_B.match(s)
+    if not m: return None
+    deg, mins, secs, hemi = float(m.group(1)), float(m.group(2) or 0), float(m.group(3) or 0), m.group(4)
+    dec = deg + mins/60 + secs/3600
+    return -dec if hemi in ("S","W") else dec
+
+def _to_float_coord_general(val):
+    if pd.isna(val): return None
+    if isinstance(val, (int,float)): return float(val)
+    s=str(val).strip()
+    m = _HEMI_WRAP_RE.match(s)
+    if m:
+        num, hemi = m.group(1), m.group(2).upper()
+        d = _parse_dms(num) if any(ch in num for ch in "°'") else None
+        if d is None:
+            try: d=float(num)
+            except: return None
+        return -abs(d) if hemi in ("S","W") else abs(d)
+    if any(ch in s for ch in "°'"):
+        return _parse_dms(s)
+    try: return float(s)
+    except: return None
+
+def _fix_lon_360(lon):
+    if lon is None: return None
+    if lon > 180.0: return lon - 360.0
+    if lon < -180.0: return None
+    return lon
+
+_DMS_EXTRACT_RE = r"^\s*(\d+(?:\.\d+)?)[°\s\-]?(\d+(?:\.\d+)?)?[\s'\-]?(\d+(?:\.\d+)?)?\s*\"?\s*([NSEW])?\s*$"
+
+def _coord_series_to_float(s: pd.Series) -> pd.Series:
+    """Vectorized coordinate parse: numeric fast path, then a single regex
+    extract for DMS-style values, then the per-value fallback for leftovers."""
+    num = pd.to_numeric(s, errors="coerce")
+    rem = num.isna() & s.notna()
+    if rem.any():
+        txt = s[rem].astype(str).str.strip().str.upper() \
+                .str.replace("º","°",regex=False).str.replace("’","'",regex=False)
+        parts = txt.str.extract(_DMS_EXTRACT_RE)
+        deg  = pd.to_numeric(parts[0], errors="coerce")
+        mins = pd.to_numeric(parts[1], errors="coerce").fillna(0.0)
+        secs = pd.to_numeric(parts[2], errors="coerce").fillna(0.0)
+        dec = deg + mins/60.0 + secs/3600.0
+        dec = dec.where(~parts[3].isin(["S","W"]), -dec)
+        num.loc[rem] = dec
+        still = num.isna() & s.notna()
+        if still.any():
+            num.loc[still] = pd.to_numeric(s[still].apply(_to_float_coord_general), errors="coerce")
+    return num
+
+def clean_piracy_df(df: pd.DataFrame) -> pd.DataFrame:
+    if df is None or df.empty: return pd.DataFrame(columns=["LAT","LON"])
+    cols = {c.strip(): c for c in df.columns}
+    lat_col = next((cols[c] for c in cols if c in PIRACY_LAT_ALIASES), None)
+    lon_col = next((cols[c] for c in cols if c in PIRACY_LON_ALIASES), None)
+    if lat_col is None or lon_col is None:
+        cand = [c for c in df.columns if c.lower().startswith(("lat","y"))]
+        lat_col = lat_col or (cand[0] if cand else None)
+        cand = [c for c in df.columns if c.lower().startswith(("lon","x","long","lng"))]
+        lon_col = lon_col or (cand[0] if cand else None)
+    if lat_col is None or lon_col is None:
+        return pd.DataFrame(columns=["LAT","LON"])
+    lat = _coord_series_to_float(df[lat_col])
+    lon = _coord_series_to_float(df[lon_col])
+    lon = lon.mask(lon > 180.0, lon - 360.0).mask(lon < -180.0)
+    out = pd.DataFrame({"LAT": lat, "LON": lon}).dropna()
+    out = out[(out["LAT"].between(-90, 90)) & (out["LON"].between(-180, 180))]
+    # float32 halves memory and is ~1m precision — plenty for 10-200km buffers
+    return out.drop_duplicates().astype({"LAT":"float32","LON":"float32"})
+
+@st.cache_data(show_spinner=False)
+def load_piracy(raw_bytes: bytes) -> pd.DataFrame:
+    """Read + clean the piracy CSV, cached on the file bytes so slider-driven
+    reruns (and re-uploads of the same file) skip the parse entirely."""
+    return clean_piracy_df(pd.read_csv(io.BytesIO(raw_bytes)))
+
+@lru_cache(maxsize=4096)
+def _norm_country(c):
+    if c is None or (isinstance(c, float) and pd.isna(c)):
+        return "Unknown"
+    c = _COUNTRY_SPLIT_RE.split(str(c))[0].strip()
+    return c.title()
+
+def _wpi_rows_from_bytes(df_bytes: bytes) -> List[Dict[str,str]]:
+    """Parse the WPI CSV into row dicts — pyarrow's C parser when available,
+    csv.DictReader otherwise. All columns are read as strings so downstream
+    parsing sees exactly what DictReader would have produced."""
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+    except ImportError:
+        pa = None
+    if pa is not None:
+        try:
+            raw = df_bytes[3:] if df_bytes.startswith(b"\xef\xbb\xbf") else df_bytes
+            header = next(csv.reader(io.StringIO(raw.split(b"\n",1)[0].decode("utf-8","ignore"))))
+            tbl = pacsv.read_csv(
+                io.BytesIO(raw),
+                convert_options=pacsv.ConvertOptions(column_types={c: pa.string() for c in header}),
+            )
+            return tbl.to_pylist()
+        except Exception:
+            pass
+    text=df_bytes.decode("utf-8-sig","ignore")
+    return list(csv.DictReader(io.StringIO(text)))
+
+@st.cache_data(show_spinner=False)
+def load_wpi(df_bytes: Optional[bytes]) -> Tuple[List[Dict[str,str]], List[str], Optional[str], Dict[str, Tuple[str, ...]], Dict[str, Dict[str,str]], Dict[str, Tuple[float,float]], Tuple[str, ...]]:
+    """
+    Return: (rows, all_port_names, country_col_name_or_None, ports_by_country,
+             by_main, latlon_by_main, country_names_sorted)
+    """
+    if df_bytes is None:
+        path="UpdatedPub150.csv"
+        if not os.path.exists(path): return [], [], None, {}, {}, {}, ()
+        with open(path,"rb") as f: df_bytes=f.read()
+    rows=_wpi_rows_from_bytes(df_bytes)
+    if not rows: return [], [], None, {}, {}, {}, ()
+
+    for req in ["Main Port Name","Latitude","Longitude"]:
+        if req not in rows[0]:
+            st.error(f"CSV missing '{req}'. Found: {list(rows[0].keys())}")
+            return [], [], None, {}, {}, {}, ()
+
+    country_col = None
+    for c in rows[0].keys():
+        if "country" in c.lower():
+            country_col = c; break
+
+    mains=sorted({r["Main Port Name"] for r in rows if r.get("Main Port Name")})
+
+    ports_by_country: Dict[str, Tuple[str, ...]] = {}
+    if country_col:
+        for r in rows:
+            name=r.get("Main Port Name")
+            if not name: continue
+            c = _norm_country(r.get(country_col))
+            ports_by_country.setdefault(c, []).append(name)
+        for k in list(ports_by_country.keys()):
+            # tuples: widget-state diffing compares by identity, not element-wise
+            ports_by_country[k]=tuple(sorted(set(ports_by_country[k])))
+    country_names_sorted = tuple(sorted(ports_by_country.keys()))
+
+    by_main = {r["Main Port Name"]: r for r in rows if r.get("Main Port Name")}
+
+    # parse lat/lon once per port at load time (regex/DMS parsing is the slow part)
+    latlon_by_main: Dict[str, Tuple[float,float]] = {}
+    for name, r in by_main.items():
+        try:
+            latlon_by_main[name] = latlon_from_row(r)
+        except ValueError:
+            continue
+
+    return rows, mains, country_col, ports_by_country, by_main, latlon_by_main, country_names_sorted
+
+def get_row_by_main(name: str, by_main: Dict[str, Dict[str,str]]) -> Optional[Dict[str,str]]:
+    return by_main.get(name)
+
+def latlon_from_row(r: Dict[str,str]):
+    def _to_float_coord(val: str) -> float:
+        s = _DEC_COMMA_RE.sub(r"\1.\2", (val or "").strip())
+        try: return float(s)
+        except:
+            d=_parse_dms(s)
+            if d is None: raise ValueError(f"Unsupported coordinate: '{val}'")
+            return d
+    return _to_float_coord(r["Latitude"]), _to_float_coord(r["Longitude"])
+
+# ---------- Congestion & alias ----------
+@st.cache_data(show_spinner=False)
+def load_congestion_advanced(df_bytes):
+    from utils import canon_name
+    if df_bytes is None:
+        return {"by_name":{}, "geo":None, "raw":pd.DataFrame()}
+    text = df_bytes.decode("utf-8-sig","ignore")
+    reader = csv.DictReader(io.StringIO(text))
+    rows = list(reader)
+    if not rows:
+        return {"by_name":{}, "geo":None, "raw":pd.DataFrame()}
+    df = pd.DataFrame(rows)
+    name_col = next((c for c in df.columns if c.lower() in ("port","name","port_name","portname")), None)
+    wait_col = next((c for c in df.columns if c.lower() in ("waittime_hr","wait_hr","waithours","wait_hours","wait","delay_hr","delay_hours")), None)
+    lat_col  = next((c for c in df.columns if c.lower() in ("lat","latitude","y")), None)
+    lon_col  = next((c for c in df.columns if c.lower() in ("lon","longitude","x","long","lng")), None)
+
+    if name_col is None or wait_col is None:
+        st.warning("Congestion CSV needs at least a Port/Name column and a WaitTime_hr (or equivalent) column.")
+        return {"by_name":{}, "geo":None, "raw":df}
+
+    df["__port_name__"] = df[name_col].astype(str)
+    df["__wait__"] = pd.to_numeric(df[wait_col], errors="coerce").fillna(0.0).astype("float32")
+    df["__key__"] = df["__port_name__"].map(canon_name)
+
+    mask = df["__key__"].astype(bool)
+    by_name = dict(zip(df.loc[mask,"__key__"], df.loc[mask,"__wait__"].astype(float)))
+
+    geo_df = None
+    if lat_col and lon_col:
+        df["__lat__"] = pd.to_numeric(df[lat_col], errors="coerce").astype("float32")
+        df["__lon__"] = pd.to_numeric(df[lon_col], errors="coerce").astype("float32")
+        geo_df = df.dropna(subset=["__lat__","__lon__"])[["__port_name__","__wait__","__lat__","__lon__"]].copy()
+
+    return {"by_name": by_name, "geo": geo_df, "raw": df}
+
+@st.cache_data(show_spinner=False)
+def load_alias_map(df_bytes):
+    from utils import canon_name
+    if df_bytes is None: 
+        return {}
+    text = df_bytes.decode("utf-8-sig","ignore")
+    reader = csv.DictReader(io.StringIO(text))
+    alias = {}
+    for row in reader:
+        wpi = canon_name(row.get("WPI_Name",""))
+        src = canon_name(row.get("Source_Name",""))
+        if wpi and src:
+            alias[wpi] = src
+    return alias
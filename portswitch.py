@@ -1,24 +1,36 @@
 from typing import Dict, List, Optional, Tuple
+import numpy as np
 import pandas as pd
 import streamlit as st
-import folium
-import difflib
-from math import radians, sin, cos, asin, sqrt
+from math import radians
+from concurrent.futures import ThreadPoolExecutor
 
-from routing import compute_route, eta_hours
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
 
-def _haversine_nm(lat1, lon1, lat2, lon2):
-    R_km = 6371.0
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1))*cos(radians(lat2))*sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    km = R_km * c
-    return km * 0.539957
+from routing import compute_route, eta_hours
+from risk import _unit_xyz
+from _fast import haversine_nm
+
+_EARTH_R_KM = 6371.0
+
+def _equirect_nm_vec(lat1, lon1, lats, lons):
+    """Equirectangular distance in NM — flat-earth approximation, one cos()
+    on the reference latitude. Good enough for a coarse radius screen; use
+    haversine_nm where the distance itself matters."""
+    lat1, lon1 = radians(lat1), radians(lon1)
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    dx = (lons - lon1) * np.cos((lats + lat1) / 2.0)
+    dy = lats - lat1
+    return 6371.0 * np.sqrt(dx*dx + dy*dy) * 0.539957
 
 def evaluate_portswitch(
     route_info: dict,
-    rows: List[Dict[str,str]],
+    by_main: Dict[str, Dict[str,str]],
+    latlon_by_main: Dict[str, Tuple[float,float]],
     mains: List[str],
     ports_by_country: Dict[str, List[str]],
     country_col: Optional[str],
@@ -32,8 +44,8 @@ def evaluate_portswitch(
     geo_radius_km: float,
     ps_controls: dict
 ):
-    from data_sources import get_row_by_main, latlon_from_row, _norm_country
-    from utils import canon_name, has_rapidfuzz, rf_match
+    from data_sources import get_row_by_main, _norm_country
+    from utils import canon_name, fuzzy_best_match, has_rapidfuzz, rf_match_many
 
     if not route_info: return None
 
@@ -41,27 +53,31 @@ def evaluate_portswitch(
     o_lon0, o_lat0 = oc_ll[0]
     d_lon0, d_lat0 = oc_ll[-1]
     baseline_dest = route_info["destination"]
-    baseline_row = get_row_by_main(baseline_dest.replace(" (baseline)", ""), rows)
+    baseline_name = baseline_dest.replace(" (baseline)", "")
+    baseline_row = get_row_by_main(baseline_name, by_main)
     baseline_country = _norm_country(baseline_row.get(country_col, "Unknown")) if (baseline_row and country_col) else "Unknown"
 
     # candidate list
     if ps_controls["same_country_only"] and country_col:
-        candidates = ports_by_country.get(baseline_country, [])
+        candidates = list(ports_by_country.get(baseline_country, ()))
     else:
-        candidates = [p for p in (mains or [])]
+        candidates = list(mains or ())
     if baseline_dest not in candidates:
         candidates.append(baseline_dest)
 
-    # radius filter around baseline dest
-    cand_filtered = []
-    if baseline_row:
-        b_lat, b_lon = latlon_from_row(baseline_row)
-        for p in candidates:
-            rw = get_row_by_main(p, rows)
-            if not rw: continue
-            plat, plon = latlon_from_row(rw)
-            if ps_controls["radius_nm"] <= 0 or _haversine_nm(b_lat, b_lon, plat, plon) <= ps_controls["radius_nm"]:
-                cand_filtered.append(p)
+    # candidate coordinates come straight from the load-time index
+    candidates = [p for p in candidates if p in latlon_by_main]
+
+    # radius screen around baseline dest — equirectangular is plenty for a
+    # coarse yes/no and skips most of the trig; radius widened 2% so the
+    # flat-earth error never drops a port haversine would have kept
+    b_ll = latlon_by_main.get(baseline_name)
+    if b_ll and candidates and ps_controls["radius_nm"] > 0:
+        b_lat, b_lon = b_ll
+        lats = np.array([latlon_by_main[p][0] for p in candidates])
+        lons = np.array([latlon_by_main[p][1] for p in candidates])
+        d_nm = _equirect_nm_vec(b_lat, b_lon, lats, lons)
+        cand_filtered = [candidates[i] for i in np.where(d_nm <= ps_controls["radius_nm"] * 1.02)[0]]
     else:
         cand_filtered = candidates
 
@@ -70,12 +86,50 @@ def evaluate_portswitch(
     if not cand_filtered:
         return None
 
-    # congestion resolver
+    # SoA coordinate arrays aligned with cand_filtered
+    cand_lats = np.array([latlon_by_main[p][0] for p in cand_filtered])
+    cand_lons = np.array([latlon_by_main[p][1] for p in cand_filtered])
+
+    # congestion resolver — shared lookups hoisted out of the per-candidate closure
+    by_name = CONG["by_name"] if CONG else {}
+    choices = tuple(by_name.keys())
+    fuzzy_threshold = ps_controls.get("fuzzy_threshold", 88)
+
+    # batch-score every candidate that will need a fuzzy lookup in one cdist
+    # call instead of one extractOne scan per candidate
+    rf_ok = has_rapidfuzz()
+    fuzzy_match: Dict[str, str] = {}
+    if choices and rf_ok:
+        pending = tuple(dict.fromkeys(
+            k for k in (canon_name(p) for p in cand_filtered)
+            if k and k not in by_name and not (ALIAS and ALIAS.get(k) in by_name)
+        ))
+        if pending:
+            scores = rf_match_many(pending, choices)
+            best_j = scores.argmax(axis=1)
+            for qi, k in enumerate(pending):
+                if scores[qi, best_j[qi]] >= fuzzy_threshold:
+                    fuzzy_match[k] = choices[best_j[qi]]
+
+    # geo columns converted once, not per candidate
+    geo_df = CONG["geo"] if CONG else None
+    if geo_df is not None and len(geo_df):
+        geo_lat  = geo_df["__lat__"].to_numpy(dtype=np.float64)
+        geo_lon  = geo_df["__lon__"].to_numpy(dtype=np.float64)
+        geo_wait = geo_df["__wait__"].to_numpy(dtype=np.float64)
+        # KD-tree on unit-sphere xyz (same trick as risk.piracy_tree); stashed
+        # on CONG so it survives the candidate loop within this evaluation
+        geo_tree = CONG.get("_tree")
+        if geo_tree is None and cKDTree is not None:
+            geo_tree = cKDTree(_unit_xyz(np.radians(geo_lat), np.radians(geo_lon)))
+            CONG["_tree"] = geo_tree
+    else:
+        geo_lat = geo_lon = geo_wait = geo_tree = None
+
     def resolve_wait_for_port(wpi_name: str, wpi_lat: float, wpi_lon: float) -> float:
-        if not CONG or (not CONG["by_name"] and CONG["geo"] is None):
+        if not CONG or (not by_name and CONG["geo"] is None):
             return 0.0
         wpi_key = canon_name(wpi_name)
-        by_name = CONG["by_name"]
         # alias + exact
         if ALIAS and wpi_key in ALIAS:
             src_key = ALIAS[wpi_key]
@@ -83,91 +137,107 @@ def evaluate_portswitch(
                 return by_name[src_key]
         if wpi_key in by_name:
             return by_name[wpi_key]
-        # fuzzy
-        if by_name:
-            choices = list(by_name.keys())
-            if has_rapidfuzz():
-                match_key, score = rf_match(wpi_key, choices)
-                if match_key and score >= ps_controls.get("fuzzy_threshold", 88):
-                    return by_name[match_key]
-            else:
-                match = difflib.get_close_matches(wpi_key, choices, n=1, cutoff=ps_controls.get("fuzzy_threshold", 88)/100.0)
-                if match:
-                    return by_name[match[0]]
+        # fuzzy — batch-scored above with rapidfuzz, per-key fallback without
+        if wpi_key in fuzzy_match:
+            return by_name[fuzzy_match[wpi_key]]
+        if by_name and not rf_ok:
+            match_key, _ = fuzzy_best_match(wpi_key, choices, fuzzy_threshold)
+            if match_key:
+                return by_name[match_key]
         # geo nearest
-        geo_df = CONG["geo"]
-        if geo_df is not None and wpi_lat is not None and wpi_lon is not None and geo_radius_km > 0:
-            best = None; best_d = 1e18
-            for _, r in geo_df.iterrows():
-                d = _haversine_nm(wpi_lat, wpi_lon, float(r["__lat__"]), float(r["__lon__"])) * 1.852  # nm->km
-                if d < best_d:
-                    best_d = d; best = r
-            if best is not None and best_d <= geo_radius_km:
-                return float(best["__wait__"])
+        if geo_lat is not None and wpi_lat is not None and wpi_lon is not None and geo_radius_km > 0:
+            if geo_tree is not None:
+                chord, i = geo_tree.query(_unit_xyz(np.radians([wpi_lat]), np.radians([wpi_lon])), k=1)
+                d_nearest = 2.0*_EARTH_R_KM*np.arcsin(float(chord[0])/2.0)
+                i = int(i[0])
+            else:
+                d_km = haversine_nm(float(wpi_lat), float(wpi_lon), geo_lat, geo_lon) * 1.852  # nm->km
+                i = int(np.argmin(d_km))
+                d_nearest = d_km[i]
+            if d_nearest <= geo_radius_km:
+                return float(geo_wait[i])
         return 0.0
 
-    # compute candidates
-    results = []
-    for p in cand_filtered:
-        rw = get_row_by_main(p, rows)
-        if not rw:
-            continue
-        plat, plon = latlon_from_row(rw)
-
-        coords, km, nm = compute_route(o_lat0, o_lon0, plat, plon)
-        eta_h = eta_hours(nm, speed_kn) or 0.0
-
-        wait_h = resolve_wait_for_port(p, plat, plon)
-
-        days = (eta_h + wait_h) / 24.0
-        fuel_t = cons_tpd * days
-        co2_t  = fuel_t * ef_tco2_per_t_fuel
-        cost_u = fuel_t * fuel_price
-
-        results.append({
-            "Port": p,
-            "Distance_NM": nm,
-            "ETA_h": eta_h,
-            "Wait_h": wait_h,
-            "Adj_ETA_h": eta_h + wait_h,
-            "Fuel_t": fuel_t,
-            "CO2_t": co2_t,
-            "Cost_USD": cost_u,
-            "coords": coords
-        })
-
-    if not results:
-        return None
-
-    df = pd.DataFrame(results)
-
-    # normalize helper
-    def norm_col(df_, col):
-        rng = df_[col].max() - df_[col].min()
-        if pd.isna(rng) or rng == 0:
-            return pd.Series([0.0]*len(df_), index=df_.index)
-        return (df_[col] - df_[col].min()) / rng
-
-    df["ETA_h_norm"]    = norm_col(df, "ETA_h")
-    df["Wait_h_norm"]   = norm_col(df, "Wait_h")
-    df["Cost_USD_norm"] = norm_col(df, "Cost_USD")
-    df["CO2_t_norm"]    = norm_col(df, "CO2_t")
-
-    w_time = ps_controls["w_time"]; w_cong = ps_controls["w_cong"]
-    w_cost = ps_controls["w_cost"]; w_co2  = ps_controls["w_co2"]
-
-    df["score"] = (
-        df["ETA_h_norm"]    * w_time +
-        df["Wait_h_norm"]   * w_cong +
-        df["Cost_USD_norm"] * w_cost +
-        df["CO2_t_norm"]    * w_co2
-    )
-
-    df = df.sort_values("score", ascending=True).reset_index(drop=True)
-    best = df.iloc[0]
+    # compute candidates — SoA arrays filled in the loop, derived columns
+    # vectorized afterwards (no per-row dict construction)
+    n_cand = len(cand_filtered)
+    nm_arr   = np.empty(n_cand)
+    eta_arr  = np.empty(n_cand)
+    wait_arr = np.empty(n_cand)
+    coords_list: List[list] = [None]*n_cand
+
+    # routes are cached on 2-decimal-rounded endpoints (routing.maritime_route),
+    # so candidates that collide at that resolution share one searoute call;
+    # the distinct cold calls run on a thread pool
+    dest_keys = [(round(float(cand_lats[i]), 2), round(float(cand_lons[i]), 2)) for i in range(n_cand)]
+    uniq_keys = list(dict.fromkeys(dest_keys))
+    with ThreadPoolExecutor(max_workers=min(8, len(uniq_keys))) as ex:
+        routes = dict(zip(uniq_keys, ex.map(
+            lambda k: compute_route(o_lat0, o_lon0, k[0], k[1]), uniq_keys)))
+
+    for i, p in enumerate(cand_filtered):
+        coords, km, nm = routes[dest_keys[i]]
+        nm_arr[i]   = nm
+        eta_arr[i]  = eta_hours(nm, speed_kn) or 0.0
+        wait_arr[i] = resolve_wait_for_port(p, float(cand_lats[i]), float(cand_lons[i]))
+        coords_list[i] = coords
+
+    days   = (eta_arr + wait_arr) / 24.0
+    fuel_t = cons_tpd * days
+    co2_t  = fuel_t * ef_tco2_per_t_fuel
+    cost_u = fuel_t * fuel_price
+
+    df = pd.DataFrame({
+        "Port": cand_filtered,
+        "Distance_NM": nm_arr,
+        "ETA_h": eta_arr,
+        "Wait_h": wait_arr,
+        "Adj_ETA_h": eta_arr + wait_arr,
+        "Fuel_t": fuel_t,
+        "CO2_t": co2_t,
+        "Cost_USD": cost_u,
+        "coords": coords_list,
+    })
+
+    # min-max normalize all four criteria in one pass, score as a matmul
+    M = np.column_stack([eta_arr, wait_arr, cost_u, co2_t])
+    mins = M.min(axis=0)
+    ranges = M.max(axis=0) - mins
+    ranges[ranges == 0] = 1.0
+    Mn = (M - mins) / ranges
+    w = np.array([ps_controls["w_time"], ps_controls["w_cong"],
+                  ps_controls["w_cost"], ps_controls["w_co2"]])
+    score = Mn @ w
+
+    df[["ETA_h_norm","Wait_h_norm","Cost_USD_norm","CO2_t_norm"]] = Mn
+    df["score"] = score
+
+    # the recommendation comes straight from the arrays — no sorted copy or
+    # iloc[0] Series materialization needed to know the winner
+    best_idx = int(np.argmin(score))
+    best = {
+        "Port": cand_filtered[best_idx],
+        "Distance_NM": float(nm_arr[best_idx]),
+        "ETA_h": float(eta_arr[best_idx]),
+        "Wait_h": float(wait_arr[best_idx]),
+        "Adj_ETA_h": float(eta_arr[best_idx] + wait_arr[best_idx]),
+        "Fuel_t": float(fuel_t[best_idx]),
+        "CO2_t": float(co2_t[best_idx]),
+        "Cost_USD": float(cost_u[best_idx]),
+        "coords": coords_list[best_idx],
+        "score": float(score[best_idx]),
+    }
+
+    # the UI only ever shows top_n_show rows — argpartition pulls those out in
+    # O(n) and only the selected handful gets sorted
+    top_n = min(int(ps_controls.get("top_n_show", n_cand)), n_cand)
+    idx = np.argpartition(score, top_n - 1)[:top_n] if top_n < n_cand else np.arange(n_cand)
+    idx = idx[np.argsort(score[idx], kind="stable")]
+    df = df.iloc[idx]
     return df, best
 
-def draw_portswitch_markers(df: pd.DataFrame, top_n: int, best_row: pd.Series, fmap):
+def draw_portswitch_markers(df: pd.DataFrame, top_n: int, best_row: dict, fmap):
+    import folium  # deferred with the rest of the map stack (see app.py)
     # annotate on folium map
     for _, row in df.head(top_n).iterrows():
         lat_cand, lon_cand = row["coords"][-1][1], row["coords"][-1][0]
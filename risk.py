@@ -1,21 +1,116 @@
-from shapely.geometry import LineString, Point
-import pandas as pd
-
-def piracy_hits_along_route(route_coords_lonlat, piracy_df: pd.DataFrame, buffer_km: float):
-    """Returns (hits, total_incidents)."""
-    if piracy_df is None or piracy_df.empty:
-        return 0, 0
-    route_line = LineString([(lon,lat) for lon,lat in route_coords_lonlat])
-    buf_deg = (1/111.32)*float(buffer_km)
-    total_inc = len(piracy_df)
-    lons=[p[0] for p in route_coords_lonlat]; lats=[p[1] for p in route_coords_lonlat]
-    min_lon,max_lon = min(lons)-buf_deg*1.5, max(lons)+buf_deg*1.5
-    min_lat,max_lat = min(lats)-buf_deg*1.5, max(lats)+buf_deg*1.5
-    cand = piracy_df[(piracy_df["LON"].between(min_lon,max_lon)) & (piracy_df["LAT"].between(min_lat,max_lat))]
-    buf_geom = route_line.buffer(buf_deg)
-    risk_hits=0
-    for _,row in cand.iterrows():
-        try: pt=Point(float(row["LON"]), float(row["LAT"]))
-        except: continue
-        if buf_geom.intersects(pt): risk_hits+=1
-    return risk_hits, total_inc
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+try:
+    from shapely import contains_xy as _contains_xy  # shapely >= 2
+except ImportError:
+    try:
+        from shapely.vectorized import contains as _contains_xy  # shapely 1.8
+    except ImportError:
+        _contains_xy = None
+
+_EARTH_R_KM = 6371.0
+
+def _unit_xyz(lat_rad, lon_rad):
+    cl = np.cos(lat_rad)
+    return np.column_stack([cl*np.cos(lon_rad), cl*np.sin(lon_rad), np.sin(lat_rad)])
+
+@st.cache_resource(show_spinner=False)
+def piracy_tree(piracy_df: pd.DataFrame):
+    """KD-tree over the piracy incidents on the unit sphere, built once per
+    uploaded CSV. Returns None when scipy is unavailable or there is no data."""
+    if cKDTree is None or piracy_df is None or piracy_df.empty:
+        return None
+    lat = np.radians(piracy_df["LAT"].to_numpy(dtype=np.float64))
+    lon = np.radians(piracy_df["LON"].to_numpy(dtype=np.float64))
+    return cKDTree(_unit_xyz(lat, lon))
+
+@st.cache_resource(show_spinner=False)
+def build_piracy_index(piracy_df: pd.DataFrame):
+    """STRtree over the piracy incidents plus their coordinate arrays, built
+    once per uploaded CSV and shared across every route queried against it.
+    Requires shapely >= 2 (index-returning queries); returns None otherwise."""
+    try:
+        from shapely.strtree import STRtree
+        from shapely import points as _mk_points
+    except ImportError:
+        return None
+    if piracy_df is None or piracy_df.empty:
+        return None
+    lons = piracy_df["LON"].to_numpy(dtype=np.float64)
+    lats = piracy_df["LAT"].to_numpy(dtype=np.float64)
+    return STRtree(_mk_points(np.column_stack([lons, lats]))), lons, lats
+
+def _hits_near_route(lat_rad, lon_rad, rlat_rad, rlon_rad, buffer_km, block=4096):
+    """Boolean mask of incidents within buffer_km of any route vertex.
+
+    Broadcast haversine over (block, M) chunks so the intermediate matrix
+    stays small regardless of CSV size.
+    """
+    hits = np.zeros(len(lat_rad), dtype=bool)
+    for s in range(0, len(lat_rad), block):
+        la = lat_rad[s:s+block, None]; lo = lon_rad[s:s+block, None]
+        a = np.sin((rlat_rad[None,:]-la)/2)**2 + \
+            np.cos(la)*np.cos(rlat_rad[None,:])*np.sin((rlon_rad[None,:]-lo)/2)**2
+        d_km = 2.0*_EARTH_R_KM*np.arcsin(np.sqrt(a))
+        hits[s:s+block] = d_km.min(axis=1) <= buffer_km
+    return hits
+
+def piracy_hits_along_route(route_coords_lonlat, piracy_df: pd.DataFrame, buffer_km: float, tree=None, index=None):
+    """Returns (hits, total_incidents). `index` is an optional prebuilt
+    STRtree bundle from build_piracy_index; `tree` the cKDTree fallback."""
+    if piracy_df is None or piracy_df.empty:
+        return 0, 0
+    total_inc = len(piracy_df)
+    route = np.asarray(route_coords_lonlat, dtype=np.float32)  # lon,lat
+    buf_deg = (1/111.32)*float(buffer_km)
+    if index is not None and _contains_xy is not None:
+        # R-tree prefilter on the buffer's bbox, then confirm containment on
+        # just that subset — the tree is built once, each route only pays a query
+        from shapely.geometry import LineString
+        strtree, lons, lats = index
+        buf_geom = LineString(route.astype(np.float64)).buffer(buf_deg, resolution=4)
+        cand_idx = strtree.query(buf_geom)
+        if len(cand_idx) == 0:
+            return 0, total_inc
+        mask = _contains_xy(buf_geom, lons[cand_idx], lats[cand_idx])
+        return int(mask.sum()), total_inc
+    if _contains_xy is not None:
+        # exact stage: bbox prefilter, then one vectorized GEOS containment
+        # call against the buffered route (low resolution keeps the polygon
+        # cheap; the answer matches iterating Point.intersects per incident)
+        min_lon, min_lat = route.min(axis=0) - buf_deg*1.5
+        max_lon, max_lat = route.max(axis=0) + buf_deg*1.5
+        cand = piracy_df[(piracy_df["LON"].between(min_lon,max_lon)) & (piracy_df["LAT"].between(min_lat,max_lat))]
+        if cand.empty:
+            return 0, total_inc
+        from shapely.geometry import LineString
+        buf_geom = LineString(route.astype(np.float64)).buffer(buf_deg, resolution=4)
+        mask = _contains_xy(buf_geom,
+                            cand["LON"].to_numpy(dtype=np.float64),
+                            cand["LAT"].to_numpy(dtype=np.float64))
+        return int(mask.sum()), total_inc
+    if tree is not None:
+        # O(M log N) ball queries; radius is the chord equivalent of buffer_km
+        rxyz = _unit_xyz(np.radians(route[:,1].astype(np.float64)),
+                         np.radians(route[:,0].astype(np.float64)))
+        chord = 2.0*np.sin(float(buffer_km)/(2.0*_EARTH_R_KM))
+        idx = tree.query_ball_point(rxyz, r=chord)
+        risk_hits = len({i for lst in idx for i in lst})
+        return risk_hits, total_inc
+    min_lon, min_lat = route.min(axis=0) - buf_deg*1.5
+    max_lon, max_lat = route.max(axis=0) + buf_deg*1.5
+    cand = piracy_df[(piracy_df["LON"].between(min_lon,max_lon)) & (piracy_df["LAT"].between(min_lat,max_lat))]
+    if cand.empty:
+        return 0, total_inc
+    lat = np.radians(cand["LAT"].to_numpy(dtype=np.float32))
+    lon = np.radians(cand["LON"].to_numpy(dtype=np.float32))
+    rlat = np.radians(route[:,1]); rlon = np.radians(route[:,0])
+    risk_hits = int(_hits_near_route(lat, lon, rlat, rlon, float(buffer_km)).sum())
+    return risk_hits, total_inc
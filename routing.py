@@ -1,13 +1,38 @@
+import itertools
 from functools import lru_cache
-from typing import List, Tuple, Dict
+from typing import List, Sequence, Tuple, Dict
+import numpy as np
 from searoute import searoute
 
-def list_to_latlon(ll_lonlat: List[List[float]]) -> List[List[float]]:
-    return [[lat, lon] for lon, lat in ll_lonlat]
+def list_to_latlon(ll_lonlat) -> List[List[float]]:
+    """Swap (lon,lat) pairs to (lat,lon); accepts lists or an (N,2) ndarray."""
+    arr = np.asarray(ll_lonlat)
+    return arr[:, ::-1].tolist() if arr.size else []
+
+try:
+    import diskcache
+    _DISK_CACHE = diskcache.Cache("./.searoute_cache")
+except Exception:
+    _DISK_CACHE = None
+
+def _route_leg_cold(lon1: float, lat1: float, lon2: float, lat2: float, units: str) -> Tuple[List[List[float]], float]:
+    r = searoute([lon1, lat1], [lon2, lat2], units=units)
+    # store only (coords, length), not the full geojson — smaller disk entries
+    return r["geometry"]["coordinates"], float(r["properties"]["length"])
+
+if _DISK_CACHE is not None:
+    _route_leg_cold = _DISK_CACHE.memoize(name="route_leg")(_route_leg_cold)
+
+@lru_cache(maxsize=32768)
+def _route_leg(lon1: float, lat1: float, lon2: float, lat2: float, units: str) -> Tuple[List[List[float]], float]:
+    return _route_leg_cold(lon1, lat1, lon2, lat2, units)
 
-@lru_cache(maxsize=4096)
 def maritime_route(lon1: float, lat1: float, lon2: float, lat2: float, units: str="km") -> Dict:
-    return searoute([lon1, lat1], [lon2, lat2], units=units)
+    """Routed via a layered cache — in-process LRU over an optional on-disk
+    store that survives restarts — keyed on coordinates rounded to 2 decimals
+    (~1 km) so near-identical endpoints share one searoute call."""
+    coords, length = _route_leg(round(lon1, 2), round(lat1, 2), round(lon2, 2), round(lat2, 2), units)
+    return {"geometry": {"coordinates": coords}, "properties": {"length": length, "units": units}}
 
 def compute_route(a_lat: float, a_lon: float, b_lat: float, b_lon: float) -> Tuple[List[List[float]], float, float]:
     r = maritime_route(a_lon, a_lat, b_lon, b_lat, units="km")
@@ -18,3 +43,121 @@ def compute_route(a_lat: float, a_lon: float, b_lat: float, b_lon: float) -> Tup
 
 def eta_hours(dist_nm: float, speed_kn: float):
     return None if speed_kn <= 0 else dist_nm / speed_kn
+
+_BRUTE_FORCE_MAX = 8  # 8! x 10 int32 permutation table is ~1.6MB; DP beyond that
+
+def brute_force_order(dist: Sequence[Sequence[float]]) -> Tuple[int, ...]:
+    """Exact ordering by scoring every permutation in one numpy kernel.
+
+    Enumerates the k! interior orderings as an int32 array, prepends the
+    origin column and appends the destination column, then computes all
+    path lengths at once with D[seq[:,:-1], seq[:,1:]].sum(axis=1) — no
+    Python-level accumulation. Only sensible for small k; held_karp_order
+    covers the rest.
+    """
+    D = np.asarray(dist, dtype=np.float32)
+    n = len(D)
+    if n <= 3:
+        return tuple(range(n))
+    perms = np.array(list(itertools.permutations(range(1, n-1))), dtype=np.int32)
+    seq = np.hstack([
+        np.zeros((len(perms),1), np.int32),
+        perms,
+        np.full((len(perms),1), n-1, np.int32),
+    ])
+    sums = D[seq[:,:-1], seq[:,1:]].sum(axis=1)
+    return tuple(int(i) for i in seq[int(sums.argmin())])
+
+_HELD_KARP_MAX = 12  # the 2^k x k DP table gets unreasonable past this
+
+def branch_and_bound_order(dist: Sequence[Sequence[float]]) -> Tuple[int, ...]:
+    """Exact DFS ordering with cost-bound pruning, O(k) memory.
+
+    Seeds the upper bound with a nearest-neighbour tour, then explores
+    partial orderings nearest-first and abandons any prefix whose cost plus
+    a lower bound (cheapest incoming edge of every unvisited node and the
+    destination) already meets the best tour. Covers stop counts where the
+    Held-Karp table would no longer fit.
+    """
+    D = np.asarray(dist, dtype=np.float64)
+    n = len(D)
+    if n <= 3:
+        return tuple(range(n))
+    interior = list(range(1, n-1))
+
+    # nearest-neighbour seed
+    seed=[]; cur=0; remaining=set(interior); cost=0.0
+    while remaining:
+        nxt = min(remaining, key=lambda j: D[cur, j])
+        seed.append(nxt); remaining.remove(nxt)
+        cost += D[cur, nxt]; cur = nxt
+    best_cost = cost + D[cur, n-1]
+    best_order = seed
+
+    col_min = np.where(np.eye(n, dtype=bool), np.inf, D).min(axis=0)
+
+    def dfs(cur, remaining, cost, rem_lb, path):
+        nonlocal best_cost, best_order
+        if not remaining:
+            total = cost + D[cur, n-1]
+            if total < best_cost:
+                best_cost, best_order = total, path.copy()
+            return
+        for j in sorted(remaining, key=lambda j: D[cur, j]):
+            c2 = cost + D[cur, j]
+            if c2 + (rem_lb - col_min[j]) + col_min[n-1] >= best_cost:
+                continue
+            remaining.remove(j); path.append(j)
+            dfs(j, remaining, c2, rem_lb - col_min[j], path)
+            path.pop(); remaining.add(j)
+
+    dfs(0, set(interior), 0.0, float(col_min[interior].sum()), [])
+    return (0, *best_order, n-1)
+
+def best_stop_order(dist: Sequence[Sequence[float]]) -> Tuple[int, ...]:
+    """Pick the cheapest exact solver for the stop count."""
+    k = len(dist) - 2
+    if k <= _BRUTE_FORCE_MAX:
+        return brute_force_order(dist)
+    if k <= _HELD_KARP_MAX:
+        return held_karp_order(dist)
+    return branch_and_bound_order(dist)
+
+def held_karp_order(dist: Sequence[Sequence[float]]) -> Tuple[int, ...]:
+    """Optimal visiting order through a distance matrix with fixed endpoints.
+
+    dist[i][j] is the leg distance between waypoints i and j; index 0 is the
+    origin and index n-1 the destination. Runs Held-Karp bitmask DP over the
+    k = n-2 interior stops — O(k²·2^k) instead of O(k!) brute force.
+    Returns the full index sequence starting with 0 and ending with n-1.
+    """
+    D = np.asarray(dist, dtype=np.float32)
+    n = len(D)
+    k = n - 2
+    if k <= 0:
+        return tuple(range(n))
+    inner = D[1:n-1, 1:n-1]  # interior-to-interior legs, 0-based
+    full = (1 << k) - 1
+    dp = np.full((1 << k, k), np.inf, dtype=np.float32)
+    parent = np.full((1 << k, k), -1, dtype=np.int32)
+    for i in range(k):
+        dp[1 << i, i] = D[0, i+1]
+    for mask in range(1, full + 1):
+        bits = [i for i in range(k) if (mask >> i) & 1]
+        if len(bits) < 2:
+            continue
+        for i in bits:
+            prev = np.array([j for j in bits if j != i], dtype=np.int32)
+            cand = dp[mask ^ (1 << i), prev] + inner[prev, i]
+            j = int(cand.argmin())
+            dp[mask, i] = cand[j]
+            parent[mask, i] = prev[j]
+    closing = dp[full] + D[1:n-1, n-1]
+    i = int(closing.argmin())
+    order = [i]
+    mask = full
+    while parent[mask, i] >= 0:
+        mask, i = mask ^ (1 << i), int(parent[mask, i])
+        order.append(i)
+    order.reverse()
+    return (0, *(i+1 for i in order), n-1)
@@ -1,17 +1,20 @@
 import re, unicodedata
 import string
+from functools import lru_cache
 
 _STOPWORDS = {"port","pelabuhan","pel","harbour","harbor","terminal","marine","maritime","of","the","pt","portos"}
-_PUNCT = set(string.punctuation)
+_PARENS_RE = re.compile(r"\(.*?\)")
+_PUNCT_TRANS = str.maketrans({c: " " for c in string.punctuation})
 
+@lru_cache(maxsize=8192)
 def _strip_accents(s: str) -> str:
     return "".join(ch for ch in unicodedata.normalize("NFKD", s) if not unicodedata.combining(ch))
 
+@lru_cache(maxsize=8192)
 def canon_name(s: str) -> str:
     if not s: return ""
     s = _strip_accents(s).lower()
-    s = re.sub(r"\(.*?\)", " ", s)
-    s = "".join((" " if ch in _PUNCT else ch) for ch in s)
+    s = _PARENS_RE.sub(" ", s).translate(_PUNCT_TRANS)
     tokens = [t for t in s.split() if t and t not in _STOPWORDS]
     return " ".join(tokens)
 
@@ -23,9 +26,54 @@ def has_rapidfuzz():
     except Exception:
         return False
 
-def rf_match(query_key: str, choices):
+def rf_match(query_key: str, choices, score_cutoff: float = 0):
     from rapidfuzz import process as rf_process, fuzz as rf_fuzz
-    match = rf_process.extractOne(query_key, choices, scorer=rf_fuzz.token_sort_ratio)
+    match = rf_process.extractOne(query_key, choices, scorer=rf_fuzz.token_sort_ratio,
+                                  score_cutoff=score_cutoff)
     if not match:
         return None, 0
     return match[0], match[1]
+
+def rf_match_many(queries, choices):
+    """Score every query against every choice in one C call.
+    Returns the (len(queries), len(choices)) token_sort_ratio matrix."""
+    from rapidfuzz import process as rf_process, fuzz as rf_fuzz
+    return rf_process.cdist(queries, choices, scorer=rf_fuzz.token_sort_ratio, workers=-1)
+
+def _levenshtein_bounded(a: str, b: str, max_dist: int):
+    """Two-row rolling-buffer Levenshtein. Returns the distance, or None as
+    soon as it is proven to exceed max_dist (whole rows above the bound)."""
+    if abs(len(a) - len(b)) > max_dist:
+        return None
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b)+1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            v = min(prev[j]+1, cur[-1]+1, prev[j-1] + (ca != cb))
+            cur.append(v)
+            if v < row_min: row_min = v
+        if row_min > max_dist:
+            return None
+        prev = cur
+    return prev[-1] if prev[-1] <= max_dist else None
+
+def fuzzy_best_match(query_key: str, choices, score_cutoff: float):
+    """Best (choice, score 0-100) above score_cutoff, or (None, 0).
+    rapidfuzz (SIMD Levenshtein) when installed; otherwise a pure-Python scan
+    that short-circuits each comparison at the cutoff-implied distance."""
+    choices = tuple(choices)
+    if has_rapidfuzz():
+        return rf_match(query_key, choices, score_cutoff=score_cutoff)
+    best, best_score = None, 0.0
+    for c in choices:
+        m = max(len(query_key), len(c)) or 1
+        d = _levenshtein_bounded(query_key, c, int(m * (1.0 - score_cutoff/100.0)))
+        if d is None:
+            continue
+        score = 100.0 * (1.0 - d/m)
+        if score > best_score:
+            best, best_score = c, score
+    return best, best_score
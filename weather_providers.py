@@ -1,84 +1,164 @@
+import asyncio
 import requests, pandas as pd
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter, Retry
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# one pooled session for all weather calls: keep-alive skips the TLS
+# handshake on repeat requests, and transient failures get two retries
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                       max_retries=Retry(total=2, backoff_factor=0.2))
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
 
 def _ms_to_kph(x): return None if x is None else float(x) * 3.6
 def _m_to_km(x):  return None if x is None else float(x) / 1000.0
 
+_OW_URL = "https://api.openweathermap.org/data/2.5/weather"
+_OM_URL = "https://api.open-meteo.com/v1/forecast"
+
+def _ow_params(api_key: str, lat: float, lon: float, units: str, lang: str="en") -> dict:
+    return {"lat": lat, "lon": lon, "appid": api_key.strip(), "units": units, "lang": lang}
+
+def _om_params(lat: float, lon: float) -> dict:
+    return {
+        "latitude": lat, "longitude": lon,
+        "current": ["temperature_2m","precipitation","wind_speed_10m","wind_gusts_10m"],
+        "hourly": ["temperature_2m","precipitation","wind_speed_10m","wind_gusts_10m","visibility"],
+        "forecast_days": 2, "timezone": "auto",
+    }
+
+def _parse_openweather(j: dict, lat: float, lon: float, units: str) -> dict:
+    speed = j.get("wind", {}).get("speed")
+    wind_kph = None if speed is None else float(speed)*(1.60934 if units=="imperial" else 3.6)
+    gust = j.get("wind", {}).get("gust")
+    gust_kph = None if gust is None else float(gust)*(1.60934 if units=="imperial" else 3.6)
+    rain_1h = (j.get("rain") or {}).get("1h") or 0.0
+    snow_1h = (j.get("snow") or {}).get("1h") or 0.0
+    return {
+        "provider":"openweather",
+        "location":{"name": j.get("name",""), "lat": lat, "lon": lon},
+        "current":{
+            "temp_c": j.get("main", {}).get("temp") if units=="metric" else None,
+            "temp_f": j.get("main", {}).get("temp") if units=="imperial" else None,
+            "humidity": j.get("main",{}).get("humidity"),
+            "pressure_hpa": j.get("main",{}).get("pressure"),
+            "wind_kph": wind_kph, "gust_kph": gust_kph,
+            "precip_mm_1h": float(rain_1h)+float(snow_1h),
+            "clouds_pct": j.get("clouds",{}).get("all"),
+            "condition": (j.get("weather") or [{}])[0].get("description","").title(),
+        },
+        "hourly":[]
+    }
+
+def _parse_openmeteo(j: dict, lat: float, lon: float) -> dict:
+    cur=j.get("current",{}); hourly=j.get("hourly",{}); times=hourly.get("time",[]) or []
+    # extract each series once — the old per-row lookups rebuilt a
+    # [None]*len(times) fallback list on every access
+    none_fill = [None]*len(times)
+    temps  = hourly.get("temperature_2m") or none_fill
+    winds  = hourly.get("wind_speed_10m") or none_fill
+    gusts  = hourly.get("wind_gusts_10m") or none_fill
+    precip = hourly.get("precipitation") or none_fill
+    vis    = hourly.get("visibility") or none_fill
+    rows=[]
+    for i,t in enumerate(times):
+        rows.append({
+            "time": t,
+            "temp_c": temps[i],
+            "wind_kph": _ms_to_kph(winds[i]),
+            "gust_kph": _ms_to_kph(gusts[i]),
+            "precip_mm_1h": precip[i],
+            "vis_km": _m_to_km(vis[i]),
+            "condition":""
+        })
+    return {
+        "provider":"open-meteo",
+        "location":{"name":"", "lat": lat, "lon": lon},
+        "current":{
+            "temp_c": cur.get("temperature_2m"),
+            "wind_kph": _ms_to_kph(cur.get("wind_speed_10m")),
+            "gust_kph": _ms_to_kph(cur.get("wind_gusts_10m")),
+            "precip_mm_1h": cur.get("precipitation"),
+            "condition":""
+        },
+        "hourly": rows
+    }
+
 @st.cache_data(ttl=900, show_spinner=False)
 def fetch_weather_openweather(api_key: str, lat: float, lon: float, units: str="metric", lang: str="en") -> dict:
     if not api_key: return {"_error": "Missing OpenWeather API key"}
-    url = "https://api.openweathermap.org/data/2.5/weather"
-    params = {"lat": lat, "lon": lon, "appid": api_key.strip(), "units": units, "lang": lang}
     try:
-        r = requests.get(url, params=params, timeout=15)
+        r = _session.get(_OW_URL, params=_ow_params(api_key, lat, lon, units, lang), timeout=15)
         if r.status_code != 200: return {"_error": f"{r.status_code} — {r.text[:200]}"}
-        j = r.json()
-        speed = j.get("wind", {}).get("speed")
-        wind_kph = None if speed is None else float(speed)*(1.60934 if units=="imperial" else 3.6)
-        gust = j.get("wind", {}).get("gust")
-        gust_kph = None if gust is None else float(gust)*(1.60934 if units=="imperial" else 3.6)
-        rain_1h = (j.get("rain") or {}).get("1h") or 0.0
-        snow_1h = (j.get("snow") or {}).get("1h") or 0.0
-        return {
-            "provider":"openweather",
-            "location":{"name": j.get("name",""), "lat": lat, "lon": lon},
-            "current":{
-                "temp_c": j.get("main", {}).get("temp") if units=="metric" else None,
-                "temp_f": j.get("main", {}).get("temp") if units=="imperial" else None,
-                "humidity": j.get("main",{}).get("humidity"),
-                "pressure_hpa": j.get("main",{}).get("pressure"),
-                "wind_kph": wind_kph, "gust_kph": gust_kph,
-                "precip_mm_1h": float(rain_1h)+float(snow_1h),
-                "clouds_pct": j.get("clouds",{}).get("all"),
-                "condition": (j.get("weather") or [{}])[0].get("description","").title(),
-            },
-            "hourly":[]
-        }
+        return _parse_openweather(r.json(), lat, lon, units)
     except Exception as e:
         return {"_error": f"Request failed: {e}"}
 
 @st.cache_data(ttl=900, show_spinner=False)
 def fetch_weather_openmeteo(lat: float, lon: float) -> dict:
-    url = "https://api.open-meteo.com/v1/forecast"
-    params = {
-        "latitude": lat, "longitude": lon,
-        "current": ["temperature_2m","precipitation","wind_speed_10m","wind_gusts_10m"],
-        "hourly": ["temperature_2m","precipitation","wind_speed_10m","wind_gusts_10m","visibility"],
-        "forecast_days": 2, "timezone": "auto",
-    }
     try:
-        r = requests.get(url, params=params, timeout=15)
+        r = _session.get(_OM_URL, params=_om_params(lat, lon), timeout=15)
         if r.status_code != 200: return {"_error": f"{r.status_code} — {r.text[:200]}"}
-        j=r.json(); cur=j.get("current",{}); hourly=j.get("hourly",{}); times=hourly.get("time",[]) or []
-        rows=[]
-        for i,t in enumerate(times):
-            rows.append({
-                "time": t,
-                "temp_c": (hourly.get("temperature_2m") or [None]*len(times))[i],
-                "wind_kph": _ms_to_kph((hourly.get("wind_speed_10m") or [None]*len(times))[i]),
-                "gust_kph": _ms_to_kph((hourly.get("wind_gusts_10m") or [None]*len(times))[i]),
-                "precip_mm_1h": (hourly.get("precipitation") or [None]*len(times))[i],
-                "vis_km": _m_to_km((hourly.get("visibility") or [None]*len(times))[i]),
-                "condition":""
-            })
-        return {
-            "provider":"open-meteo",
-            "location":{"name":"", "lat": lat, "lon": lon},
-            "current":{
-                "temp_c": cur.get("temperature_2m"),
-                "wind_kph": _ms_to_kph(cur.get("wind_speed_10m")),
-                "gust_kph": _ms_to_kph(cur.get("wind_gusts_10m")),
-                "precip_mm_1h": cur.get("precipitation"),
-                "condition":""
-            },
-            "hourly": rows
-        }
+        return _parse_openmeteo(r.json(), lat, lon)
     except Exception as e:
         return {"_error": f"Request failed: {e}"}
 
 def get_weather(provider: str, lat: float, lon: float, key: str, units: str="metric") -> dict:
     return fetch_weather_openweather(key, lat, lon, units=units) if provider=="OpenWeather" else fetch_weather_openmeteo(lat, lon)
 
+async def _fetch_weather_many_async(provider: str, points, key: str, units: str) -> list:
+    async with httpx.AsyncClient(timeout=15) as client:
+        if provider == "OpenWeather":
+            reqs = [client.get(_OW_URL, params=_ow_params(key, la, lo, units)) for la, lo in points]
+        else:
+            reqs = [client.get(_OM_URL, params=_om_params(la, lo)) for la, lo in points]
+        resps = await asyncio.gather(*reqs, return_exceptions=True)
+    out = []
+    for (la, lo), r in zip(points, resps):
+        # degrade per point like the sync fetchers — a bad body (captive
+        # portal, proxy error page) must not take down the whole batch
+        try:
+            if isinstance(r, Exception):
+                out.append({"_error": f"Request failed: {r}"})
+            elif r.status_code != 200:
+                out.append({"_error": f"{r.status_code} — {r.text[:200]}"})
+            elif provider == "OpenWeather":
+                out.append(_parse_openweather(r.json(), la, lo, units))
+            else:
+                out.append(_parse_openmeteo(r.json(), la, lo))
+        except Exception as e:
+            out.append({"_error": f"Request failed: {e}"})
+    return out
+
+@st.cache_data(ttl=900, show_spinner=False)
+def _fetch_weather_many_cached(provider: str, points: tuple, key: str, units: str) -> list:
+    return asyncio.run(_fetch_weather_many_async(provider, points, key, units))
+
+def get_weather_many(provider: str, points, key: str, units: str="metric") -> list:
+    """Fetch weather for many (lat, lon) points concurrently, order preserved.
+
+    With httpx installed all requests go out on one event loop (roughly one
+    round-trip for the whole batch, cached on the point tuple); otherwise the
+    per-point cached fetches overlap in a thread pool.
+    """
+    points = list(points)
+    if not points:
+        return []
+    if httpx is not None and not (provider == "OpenWeather" and not key):
+        try:
+            return _fetch_weather_many_cached(provider, tuple(points), key, units)
+        except RuntimeError:
+            pass  # already inside a running loop — fall through to threads
+    with ThreadPoolExecutor(max_workers=min(10, len(points))) as ex:
+        return list(ex.map(lambda p: get_weather(provider, p[0], p[1], key, units=units), points))
+
 def render_weather_card_safe(title: str, wx: dict):
     if not wx: st.info(f"{title}: Weather unavailable."); return
     if wx.get("_error"): st.warning(f"{title}: {wx['_error']}"); return